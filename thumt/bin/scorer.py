@@ -12,6 +12,7 @@ import os
 import six
 
 import tensorflow as tf
+import thumt.data.dataset as dataset
 import thumt.data.vocab as vocabulary
 import thumt.models as models
 
@@ -151,31 +152,15 @@ def set_variables(var_list, value_dict, prefix):
                     op = tf.assign(var, value_dict[name])
                     ops.append(op)
                 break
+        else:
+            # A graph variable without a checkpoint counterpart would
+            # otherwise fail with an uninitialized-variable error later
+            tf.logging.warning("Variable %s is not in the checkpoint"
+                               % var.name)
 
     return ops
 
 
-def read_files(names):
-    inputs = [[] for _ in range(len(names))]
-    files = [tf.gfile.GFile(name) for name in names]
-
-    count = 0
-
-    for lines in zip(*files):
-        lines = [line.strip() for line in lines]
-
-        for i, line in enumerate(lines):
-            inputs[i].append(line)
-
-        count += 1
-
-    # Close files
-    for fd in files:
-        fd.close()
-
-    return inputs
-
-
 def get_features(inputs, params):
     with tf.device("/cpu:0"):
         # Create datasets
@@ -254,7 +239,9 @@ def main(args):
     # Build Graph
     with tf.Graph().as_default():
         model = model_cls(params)
-        inputs = read_files(args.input)
+        # Sorting the input by source length reduces the padding in each
+        # batch; scores are restored to the original order on output
+        sorted_keys, inputs = dataset.sort_input_files(args.input)
         features = get_features(inputs, params)
         score_fn = model.get_evaluation_func()
         scores = score_fn(features, params)
@@ -284,12 +271,16 @@ def main(args):
         with tf.train.MonitoredSession(session_creator=sess_creator) as sess:
             # Restore variables
             sess.run(assign_op)
-            fd = tf.gfile.Open(args.output, "w")
+            results = []
 
             while not sess.should_stop():
-                results = sess.run(scores)
-                for value in results:
-                    fd.write("%f\n" % value)
+                results.extend(sess.run(scores).tolist())
+
+            fd = tf.gfile.Open(args.output, "w")
+
+            # Restore the original order
+            for index in range(len(results)):
+                fd.write("%f\n" % results[sorted_keys[index]])
 
             fd.close()
 
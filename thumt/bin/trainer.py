@@ -46,6 +46,8 @@ def parse_args(args=None):
                         help="Path to pre-trained checkpoint")
     parser.add_argument("--half", action="store_true",
                         help="Enable FP16 training")
+    parser.add_argument("--amp", action="store_true",
+                        help="Enable automatic mixed precision training")
     parser.add_argument("--distribute", action="store_true",
                         help="Enable distributed training")
 
@@ -73,10 +75,13 @@ def default_parameters():
         mantissa_bits=2,
         warmup_steps=4000,
         train_steps=100000,
+        log_steps=50,
         buffer_size=10000,
         constant_batch_size=False,
         device_list=[0],
         update_cycle=1,
+        # Compression of gradient all-reduce: "none" or "fp16"
+        grad_compression="fp16",
         initializer="uniform_unit_scaling",
         initializer_gain=1.0,
         loss_scale=128,
@@ -138,10 +143,19 @@ def export_params(output_dir, name, params):
     if not tf.gfile.Exists(output_dir):
         tf.gfile.MkDir(output_dir)
 
-    # Save params as params.json
     filename = os.path.join(output_dir, name)
+    json_str = params.to_json()
+
+    # Cluster jobs re-launch frequently; skip the write when the
+    # parameters did not change
+    if tf.gfile.Exists(filename):
+        with tf.gfile.Open(filename) as fd:
+            if fd.read() == json_str:
+                return
+
+    # Save params as params.json
     with tf.gfile.Open(filename, "w") as fd:
-        fd.write(params.to_json())
+        fd.write(json_str)
 
 
 def collect_params(all_params, params):
@@ -316,15 +330,17 @@ def restore_variables(checkpoint):
 
 
 def print_variables():
-    all_weights = {v.name: v for v in tf.trainable_variables()}
     total_size = 0
+    lines = []
 
-    for v_name in sorted(list(all_weights)):
-        v = all_weights[v_name]
-        tf.logging.info("%s\tshape    %s", v.name[:-2].ljust(80),
-                        str(v.shape).ljust(20))
+    for (v_name, v) in sorted((v.name, v) for v in tf.trainable_variables()):
+        lines.append("%s\tshape    %s" % (v_name[:-2].ljust(80),
+                                          str(v.shape).ljust(20)))
         v_size = np.prod(np.array(v.shape.as_list())).tolist()
         total_size += v_size
+
+    # Emit a single log record instead of one per variable
+    tf.logging.info("Trainable variables:\n%s", "\n".join(lines))
     tf.logging.info("Total trainable variables size: %d", total_size)
 
 
@@ -342,6 +358,7 @@ def main(args):
     params = merge_parameters(params, model_cls.get_parameters())
     params = import_params(args.output, args.model, params)
     override_parameters(params, args)
+    distribute.set_gradient_compression(params.grad_compression)
 
     # Export all parameters and model specific parameters
     if distribute.rank() == 0:
@@ -404,14 +421,26 @@ def main(args):
         else:
             raise RuntimeError("Optimizer %s not supported" % params.optimizer)
 
+        if args.amp:
+            # The graph rewrite selects ops to run in float16 and manages
+            # loss scaling itself, so it excludes manual FP16 training
+            if args.half:
+                raise ValueError("--amp cannot be combined with --half")
+            opt = tf.train.experimental.enable_mixed_precision_graph_rewrite(
+                opt)
+
         opt = optimizers.MultiStepOptimizer(opt, params.update_cycle)
 
         if args.half:
             opt = optimizers.LossScalingOptimizer(opt, params.loss_scale)
 
         # Optimization
+        # GATE_NONE allows each all-reduce to start as soon as its own
+        # gradient is ready, overlapping communication with the rest of
+        # the backward pass
         grads_and_vars = opt.compute_gradients(
-            loss, colocate_gradients_with_ops=True)
+            loss, gate_gradients=tf.train.Optimizer.GATE_NONE,
+            colocate_gradients_with_ops=True)
 
         if params.clip_grad_norm:
             grads, var_list = list(zip(*grads_and_vars))
@@ -440,7 +469,9 @@ def main(args):
                     "source": tf.shape(features["source"]),
                     "target": tf.shape(features["target"])
                 },
-                every_n_iter=1
+                # Fetching the loss forces a device-to-host transfer, so
+                # do not pay for it on every step
+                every_n_iter=params.log_steps
             )
         ]
 
@@ -460,11 +491,12 @@ def main(args):
             tf.add_to_collection(tf.GraphKeys.SAVERS, saver)
             train_hooks.append(
                 hooks.MultiStepHook(
-                    tf.train.CheckpointSaverHook(
+                    hooks.AsyncCheckpointSaverHook(
                         checkpoint_dir=params.output,
                         save_secs=params.save_checkpoint_secs or None,
                         save_steps=params.save_checkpoint_steps or None,
-                        saver=saver),
+                        saver=saver,
+                        max_to_keep=params.keep_checkpoint_max),
                     step=params.update_cycle)
             )
 
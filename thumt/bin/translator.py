@@ -69,6 +69,10 @@ def default_parameters():
         decode_alpha=0.6,
         decode_length=50,
         decode_batch_size=32,
+        # Compile the beam search step with XLA
+        decode_jit=False,
+        # Keep the decoding cache in half precision
+        fp16_cache=False,
         # sampling
         generate_samples=False,
         num_samples=1,
@@ -177,6 +181,11 @@ def set_variables(var_list, value_dict, prefix, feed_dict):
                     ops.append(op)
                 feed_dict[placeholder] = value_dict[name]
                 break
+        else:
+            # A graph variable without a checkpoint counterpart would
+            # otherwise fail with an uninitialized-variable error later
+            tf.logging.warning("Variable %s is not in the checkpoint"
+                               % var.name)
 
     return ops
 
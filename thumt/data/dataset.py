@@ -131,6 +131,9 @@ def get_training_input(filenames, params):
             num_parallel_calls=params.num_threads
         )
 
+        # Decouple host-side preprocessing from the training step
+        dataset = dataset.prefetch(params.buffer_size)
+
         # Create iterator
         iterator = dataset.make_one_shot_iterator()
         features = iterator.get_next()
@@ -189,6 +192,35 @@ def sort_input_file(filename, reverse=True):
     return sorted_keys, sorted_inputs
 
 
+def sort_input_files(names, reverse=True):
+    inputs = []
+    input_lens = []
+    files = [tf.gfile.GFile(name) for name in names]
+
+    count = 0
+
+    for lines in zip(*files):
+        lines = [line.strip() for line in lines]
+        input_lens.append((count, len(lines[0].split())))
+        inputs.append(lines)
+        count += 1
+
+    # Close files
+    for fd in files:
+        fd.close()
+
+    sorted_input_lens = sorted(input_lens, key=operator.itemgetter(1),
+                               reverse=reverse)
+    sorted_keys = {}
+    sorted_inputs = []
+
+    for i, (index, _) in enumerate(sorted_input_lens):
+        sorted_inputs.append(inputs[index])
+        sorted_keys[index] = i
+
+    return sorted_keys, [list(x) for x in zip(*sorted_inputs)]
+
+
 def sort_and_zip_files(names):
     inputs = []
     input_lens = []
@@ -259,6 +291,9 @@ def get_evaluation_input(inputs, params):
             }
         )
 
+        # Prepare the next batch while the current one is translated
+        dataset = dataset.prefetch(1)
+
         iterator = dataset.make_one_shot_iterator()
         features = iterator.get_next()
 
@@ -306,6 +341,9 @@ def get_inference_input(inputs, params):
             {"source": params.pad, "source_length": 0}
         )
 
+        # Prepare the next batch while the current one is translated
+        dataset = dataset.prefetch(1)
+
         iterator = dataset.make_one_shot_iterator()
         features = iterator.get_next()
 
@@ -346,6 +384,8 @@ def get_relevance_input(inputs, outputs, params):
         {"source": params.pad, "source_length": 0}
     )
 
+    dataset = dataset.prefetch(1)
+
     iterator = dataset.make_one_shot_iterator()
     features = iterator.get_next()
 
@@ -382,6 +422,8 @@ def get_relevance_input(inputs, outputs, params):
         {"target": params.pad, "target_length": 0}
     )
 
+    dataset_o = dataset_o.prefetch(1)
+
     iterator = dataset_o.make_one_shot_iterator()
     features_o = iterator.get_next()
 
@@ -428,9 +428,19 @@ def multihead_attention(queries, memories, bias, num_heads, key_size,
                 next_state["value"] = v
         else:
             q = linear(queries, key_size, True, True, scope="q_transform")
-            combined = linear(memories, key_size + value_size, True,
-                              scope="kv_transform")
-            k, v = tf.split(combined, [key_size, value_size], axis=-1)
+
+            if state is not None and "memory_key" in state:
+                # The memory projection does not depend on the decoding
+                # position, so incremental decoding reuses the keys/values
+                # computed when the memory was encoded
+                k = state["memory_key"]
+                v = state["memory_value"]
+                next_state["memory_key"] = k
+                next_state["memory_value"] = v
+            else:
+                combined = linear(memories, key_size + value_size, True,
+                                  scope="kv_transform")
+                k, v = tf.split(combined, [key_size, value_size], axis=-1)
 
         # split heads
         q = split_heads(q, num_heads)
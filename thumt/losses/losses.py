@@ -37,12 +37,18 @@ def smoothed_softmax_cross_entropy_with_logits(**kwargs):
         p = 1.0 - smoothing
         q = smoothing / n
 
-        soft_targets = tf.one_hot(tf.cast(labels, tf.int32), depth=vocab_size,
-                                  on_value=p, off_value=q)
-        soft_targets = tf.stop_gradient(soft_targets)
-        xentropy = tf.nn.softmax_cross_entropy_with_logits_v2(
-            logits=tf.cast(logits, tf.float32),
-            labels=soft_targets)
+        logits = tf.cast(logits, tf.float32)
+        ce = tf.nn.sparse_softmax_cross_entropy_with_logits(
+            logits=logits,
+            labels=labels
+        )
+        # The smoothed loss is p * ce + q * sum of the negative
+        # log-probabilities of all non-target symbols. Computing it from
+        # the sparse cross entropy and two reductions avoids building the
+        # [batch * length, vocab_size] one-hot target matrix
+        sum_nll = (tf.to_float(vocab_size) * tf.reduce_logsumexp(logits, 1)
+                   - tf.reduce_sum(logits, 1))
+        xentropy = p * ce + q * (sum_nll - ce)
 
         if normalize is False:
             return xentropy
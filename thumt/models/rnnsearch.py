@@ -290,11 +290,11 @@ def model_graph(features, mode, params):
         readout = layers.nn.linear(maxhid, params.embedding_size, False,
                                    False, scope="deepout")
 
-        # Prediction
+        # Prediction (unnormalized, see thumt.utils.inference)
         logits = layers.nn.linear(readout, tgt_vocab_size, True, False,
                                   scope="softmax")
 
-        return tf.nn.log_softmax(logits)
+        return logits
 
     maxhid = layers.nn.maxout(maxout_features, maxout_size, params.maxnum,
                               concat=False)
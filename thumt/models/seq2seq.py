@@ -102,11 +102,11 @@ def model_graph(features, mode, params):
         outputs = tf.nn.dropout(outputs, 1.0 - params.dropout)
 
     if mode == "infer":
-        # Prediction
+        # Prediction (unnormalized, see thumt.utils.inference)
         logits = layers.nn.linear(outputs[:, -1, :], tgt_vocab_size, True,
                                   scope="softmax")
 
-        return tf.nn.log_softmax(logits)
+        return logits
 
     # Prediction
     logits = layers.nn.linear(outputs, tgt_vocab_size, True, scope="softmax")
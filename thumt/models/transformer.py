@@ -111,6 +111,7 @@ def transformer_decoder(inputs, memory, bias, mem_bias, params, state=None,
                         params.hidden_size,
                         1.0 - params.attention_dropout,
                         state=layer_state,
+                        scope="multihead_attention",
                         max_relative_dis=max_relative_dis,
                     )
 
@@ -131,8 +132,14 @@ def transformer_decoder(inputs, memory, bias, mem_bias, params, state=None,
                         params.attention_value_channels or params.hidden_size,
                         params.hidden_size,
                         1.0 - params.attention_dropout,
+                        state=layer_state,
+                        scope="multihead_attention",
                         max_relative_dis=max_relative_dis,
                     )
+
+                    if layer_state is not None:
+                        next_state[layer_name].update(y["state"])
+
                     y = y["outputs"]
                     x = _residual_fn(x, y, 1.0 - params.residual_dropout)
                     x = _layer_process(x, params.layer_postprocess)
@@ -268,23 +275,30 @@ def decoding_graph(features, state, mode, params):
 
     encoder_output = state["encoder"]
 
+    # The scope is given explicitly: encoding_fn already enters "decoder"
+    # down to "multihead_attention" to pre-compute the memory keys/values,
+    # and a default_name would be uniquified to "decoder_1" at inference,
+    # breaking checkpoint names. transformer_decoder passes the attention
+    # scopes explicitly for the same reason
     if mode != "infer":
         decoder_output = transformer_decoder(decoder_input, encoder_output,
                                              dec_attn_bias, enc_attn_bias,
-                                             params)
+                                             params, scope="decoder")
     else:
         decoder_input = decoder_input[:, -1:, :]
         dec_attn_bias = dec_attn_bias[:, :, -1:, :]
         decoder_outputs = transformer_decoder(decoder_input, encoder_output,
                                               dec_attn_bias, enc_attn_bias,
-                                              params, state=state["decoder"])
+                                              params, state=state["decoder"],
+                                              scope="decoder")
 
         decoder_output, decoder_state = decoder_outputs
         decoder_output = decoder_output[:, -1, :]
+        # Unnormalized: the inference graph defers the log-softmax
+        # normalization until after candidate selection
         logits = tf.matmul(decoder_output, weights, False, True)
-        log_prob = tf.nn.log_softmax(logits)
 
-        return log_prob, {"encoder": encoder_output, "decoder": decoder_state}
+        return logits, {"encoder": encoder_output, "decoder": decoder_state}
 
     decoder_output = tf.reshape(decoder_output, [-1, hidden_size])
     logits = tf.matmul(decoder_output, weights, False, True)
@@ -366,16 +380,40 @@ class Transformer(NMTModel):
                 encoder_output = encoding_graph(features, "infer", params)
                 batch = tf.shape(encoder_output)[0]
 
+                key_size = params.attention_key_channels or \
+                    params.hidden_size
+                value_size = params.attention_value_channels or \
+                    params.hidden_size
+
                 state = {
                     "encoder": encoder_output,
-                    "decoder": {
-                        "layer_%d" % i: {
-                            "key": tf.zeros([batch, 0, params.attention_key_channels or params.hidden_size]),
-                            "value": tf.zeros([batch, 0, params.attention_value_channels or params.hidden_size])
-                        }
-                        for i in range(params.num_decoder_layers)
-                    }
+                    "decoder": {}
                 }
+
+                # The encoder-decoder attention keys/values only depend on
+                # the encoder output, so each layer projects them once here
+                # rather than at every decoding step. The variable scopes
+                # mirror transformer_decoder so kv_transform resolves to
+                # the same checkpoint names
+                with tf.variable_scope("decoder"):
+                    for i in range(params.num_decoder_layers):
+                        layer_name = "layer_%d" % i
+
+                        with tf.variable_scope(layer_name), \
+                                tf.variable_scope("encdec_attention"), \
+                                tf.variable_scope("multihead_attention"):
+                            combined = layers.nn.linear(
+                                encoder_output, key_size + value_size,
+                                True, scope="kv_transform")
+                            mem_key, mem_value = tf.split(
+                                combined, [key_size, value_size], axis=-1)
+
+                        state["decoder"][layer_name] = {
+                            "key": tf.zeros([batch, 0, key_size]),
+                            "value": tf.zeros([batch, 0, value_size]),
+                            "memory_key": mem_key,
+                            "memory_value": mem_value
+                        }
             return state
 
         def decoding_fn(features, state, params=None):
@@ -28,6 +28,28 @@ def infer_shape(x):
     return ret
 
 
+def map_structure(fn, structure):
+    """ Apply fn to each entry of a nested structure
+    :param fn: A callable applied to each leaf entry
+    :param structure: An arbitrarily nested structure of dict, list
+        and tuple
+    :return: A structure with the same layout as the input
+    """
+    if isinstance(structure, dict):
+        return {k: map_structure(fn, v) for (k, v) in structure.items()}
+
+    if isinstance(structure, (list, tuple)):
+        entries = [map_structure(fn, v) for v in structure]
+
+        if isinstance(structure, tuple) and hasattr(structure, "_fields"):
+            # namedtuple
+            return type(structure)(*entries)
+
+        return type(structure)(entries)
+
+    return fn(structure)
+
+
 def infer_shape_invariants(tensor):
     shape = tensor.shape.as_list()
     for i in range(1, len(shape) - 1):
@@ -75,11 +97,4 @@ def gather_2d(params, indices, name=None):
     :param name: An optional string
     :return: A tensor with shape [batch_size, N, ...]
     """
-    batch_size = tf.shape(params)[0]
-    range_size = tf.shape(indices)[1]
-    batch_pos = tf.range(batch_size * range_size) // range_size
-    batch_pos = tf.reshape(batch_pos, [batch_size, range_size])
-    indices = tf.stack([batch_pos, indices], axis=-1)
-    output = tf.gather_nd(params, indices, name=name)
-
-    return output
+    return tf.batch_gather(params, indices, name=name)
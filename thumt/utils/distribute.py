@@ -8,6 +8,7 @@ from __future__ import print_function
 import sys
 
 _ENGINE = None
+_COMPRESSION = "fp16"
 
 
 def enable_distributed_training():
@@ -38,11 +39,25 @@ def size():
     return _ENGINE.size() if _ENGINE is not None else 1
 
 
+def set_gradient_compression(name):
+    global _COMPRESSION
+
+    if name not in ["none", "fp16"]:
+        raise ValueError("Unknown gradient compression: %s" % name)
+
+    _COMPRESSION = name
+
+
 def all_reduce(tensor):
     if _ENGINE is None:
         return tensor
 
-    return _ENGINE.allreduce(tensor, compression=_ENGINE.Compression.fp16)
+    if _COMPRESSION == "fp16":
+        compression = _ENGINE.Compression.fp16
+    else:
+        compression = _ENGINE.Compression.none
+
+    return _ENGINE.allreduce(tensor, compression=compression)
 
 
 def get_broadcast_hook():
@@ -8,6 +8,7 @@ from __future__ import print_function
 import datetime
 import operator
 import os
+import threading
 
 import tensorflow as tf
 import thumt.utils.bleu as bleu
@@ -293,6 +294,9 @@ class EvaluationHook(tf.train.SessionRunHook):
             # Get the real value
             if self._timer.should_trigger_for_step(global_step):
                 self._timer.update_last_triggered_step(global_step)
+                # An in-flight background save may be writing the same
+                # checkpoint files, wait for it before saving and copying
+                _join_async_saves()
                 # Save model
                 save_path = os.path.join(self._base_dir, "model.ckpt")
                 saver = _get_saver()
@@ -356,6 +360,9 @@ class EvaluationHook(tf.train.SessionRunHook):
 
         if last_step != self._timer.last_triggered_step():
             global_step = last_step
+            # The evaluation restores the latest checkpoint, which may
+            # still be written in the background
+            _join_async_saves()
             tf.logging.info("Validating model at step %d" % global_step)
             score = _evaluate(self._eval_fn, self._eval_input_fn,
                               self._eval_decode_fn,
@@ -403,6 +410,97 @@ class EvaluationHook(tf.train.SessionRunHook):
             tf.logging.info("Best score: %f" % best_score)
 
 
+# Hooks with pending background checkpoint writes, see _join_async_saves
+_ASYNC_SAVER_HOOKS = []
+
+
+def _join_async_saves():
+    # Wait until all in-flight background checkpoint writes finish, so
+    # synchronous users of the checkpoint directory see complete files
+    for hook in _ASYNC_SAVER_HOOKS:
+        hook._join_save_thread()
+
+
+class AsyncCheckpointSaverHook(tf.train.CheckpointSaverHook):
+    """ Saves checkpoints every N steps or seconds without blocking
+        training: the variable values are copied into host-side snapshot
+        variables synchronously and written to disk in a background
+        thread.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._max_to_keep = kwargs.pop("max_to_keep", 5)
+        super(AsyncCheckpointSaverHook, self).__init__(*args, **kwargs)
+        self._save_thread = None
+        self._snapshot_op = None
+        self._snapshot_saver = None
+        _ASYNC_SAVER_HOOKS.append(self)
+
+    def begin(self):
+        super(AsyncCheckpointSaverHook, self).begin()
+
+        # Host-side copies of the saved variables. _save assigns them in
+        # a single run call between training steps, so a checkpoint never
+        # mixes values from different steps, and the background write only
+        # reads the copies while training updates the originals
+        snapshot_ops = []
+        var_dict = {}
+
+        with tf.device("/cpu:0"), tf.name_scope("checkpoint_snapshot"):
+            for var in tf.global_variables():
+                name = var.name.split(":")[0]
+                copy = tf.Variable(tf.zeros_like(var), trainable=False,
+                                   collections=[],
+                                   name=name.split("/")[-1])
+                snapshot_ops.append(tf.assign(copy, var))
+                var_dict[name] = copy
+
+        self._snapshot_op = tf.group(*snapshot_ops)
+        # The copies are saved under the original variable names, so the
+        # checkpoint is identical to a synchronous save
+        self._snapshot_saver = tf.train.Saver(var_dict,
+                                              max_to_keep=self._max_to_keep)
+
+    def _join_save_thread(self):
+        if self._save_thread is not None:
+            self._save_thread.join()
+            self._save_thread = None
+
+    def _save(self, session, step):
+        # At most one save runs at a time
+        self._join_save_thread()
+
+        for l in self._listeners:
+            l.before_save(session, step)
+
+        # Synchronous snapshot of the variable values
+        session.run(self._snapshot_op)
+
+        def _run_save():
+            tf.logging.info("Saving checkpoints for %d into %s." %
+                            (step, self._save_path))
+            self._snapshot_saver.save(session, self._save_path,
+                                      global_step=step)
+
+        self._save_thread = threading.Thread(target=_run_save,
+                                             name="checkpoint_save_thread")
+        self._save_thread.start()
+
+        should_stop = False
+
+        for l in self._listeners:
+            if l.after_save(session, step):
+                should_stop = True
+
+        return should_stop
+
+    def end(self, session):
+        self._join_save_thread()
+        super(AsyncCheckpointSaverHook, self).end(session)
+        # Wait for the final save to hit disk
+        self._join_save_thread()
+
+
 class MultiStepHook(tf.train.SessionRunHook):
 
     def __init__(self, hook, step=1):
@@ -10,7 +10,7 @@ import tensorflow as tf
 import thumt.utils.common as utils
 
 from collections import namedtuple
-from tensorflow.python.util import nest
+from tensorflow.contrib.compiler import jit
 
 
 class BeamSearchState(namedtuple("BeamSearchState",
@@ -18,10 +18,23 @@ class BeamSearchState(namedtuple("BeamSearchState",
     pass
 
 
-def _get_inference_fn(model_fns, features):
+# Interval (in steps) between early-termination checks of the loop
+_CHECK_TERMINATION_STEPS = 4
+
+
+def _cast_state(state, dtype):
+    """ Cast all floating point tensors of a state to the given dtype """
+    def cast_fn(x):
+        if x.dtype in (tf.float16, tf.float32):
+            return tf.cast(x, dtype)
+        return x
+
+    return utils.map_structure(cast_fn, state)
+
+
+def _get_inference_fn(model_fns, features, tiled_source, fp16_cache=False):
     def inference_fn(inputs, state):
         local_features = {
-            "source": features["source"],
             "source_length": features["source_length"],
             # [bos_id, ...] => [..., 0]
             "target": tf.pad(inputs[:, 1:], [[0, 0], [0, 1]]),
@@ -34,55 +47,97 @@ def _get_inference_fn(model_fns, features):
 
         for (model_fn, model_state) in zip(model_fns, state):
             if model_state:
-                output, new_state = model_fn(local_features, model_state)
+                # Incremental models attend to the source through their
+                # cached encoder output and only read the length of
+                # "source", so the untiled source suffices
+                model_features = dict(local_features,
+                                      source=features["source"])
+                if fp16_cache:
+                    # The cache is stored in half precision between steps,
+                    # models still compute in full precision
+                    model_state = _cast_state(model_state, tf.float32)
+                output, new_state = model_fn(model_features, model_state)
+                if fp16_cache:
+                    new_state = _cast_state(new_state, tf.float16)
                 outputs.append(output)
                 next_state.append(new_state)
             else:
-                output = model_fn(local_features)
+                # Non-incremental models re-encode every step and need one
+                # source copy per beam
+                model_features = dict(local_features, source=tiled_source)
+                output = model_fn(model_features)
                 outputs.append(output)
                 next_state.append({})
 
-        # Ensemble
-        log_prob = tf.add_n(outputs) / float(len(outputs))
+        # Ensemble: models return unnormalized logits, which are averaged
+        # before a single normalization
+        logits = tf.add_n(outputs) / float(len(outputs))
+        # log p = logits - logsumexp(logits). Subtracting the constant is
+        # O(vocab) per row, so it is deferred to the 2 * beam_size selected
+        # candidates in the beam search step
+        log_sum_exp = tf.reduce_logsumexp(logits, axis=-1)
 
-        return log_prob, next_state
+        return logits, log_sum_exp, next_state
 
     return inference_fn
 
 
+def _write_symbols(seqs, symbols, time):
+    """ Write symbols to the given position of pre-allocated buffers
+    :param seqs: A tensor with shape [batch_size, k, length]
+    :param symbols: A tensor with shape [batch_size, k]
+    :param time: A scalar tensor, the position to write to
+    :return: A tensor with shape [batch_size, k, length]
+    """
+    mask = tf.one_hot(time, tf.shape(seqs)[2], dtype=seqs.dtype)
+    return seqs * (1 - mask) + tf.expand_dims(symbols, 2) * mask
+
+
 def _beam_search_step(time, func, state, batch_size, beam_size, alpha,
-                      pad_id, eos_id):
+                      eos_id):
     # Compute log probabilities
     seqs, log_probs = state.inputs[:2]
-    flat_seqs = utils.merge_first_two_dims(seqs)
-    flat_state = nest.map_structure(lambda x: utils.merge_first_two_dims(x),
-                                    state.state)
-    step_log_probs, next_state = func(flat_seqs, flat_state)
-    step_log_probs = utils.split_first_two_dims(step_log_probs, batch_size,
-                                                beam_size)
-    next_state = nest.map_structure(
-        lambda x: utils.split_first_two_dims(x, batch_size, beam_size),
-        next_state)
-    curr_log_probs = tf.expand_dims(log_probs, 2) + step_log_probs
-
-    # Apply length penalty
+    # Only the first (time + 1) positions of the buffers are valid
+    flat_seqs = utils.merge_first_two_dims(seqs[:, :, :time + 1])
+    # The decoder state is kept flat at [batch * beam, ...], so the model
+    # call needs no per-step merge/split of the whole state
+    step_logits, step_lse, next_state = func(flat_seqs, state.state)
+    step_logits = utils.split_first_two_dims(step_logits, batch_size,
+                                             beam_size)
+    # [batch_size, beam_size]
+    step_lse = utils.split_first_two_dims(step_lse, batch_size, beam_size)
+
+    # The length penalty is a positive per-step scalar, so dividing after
+    # the top-k selection picks the same candidates without materializing
+    # a second [batch, beam, vocab] tensor
     length_penalty = tf.pow((5.0 + tf.to_float(time + 1)) / 6.0, alpha)
-    curr_scores = curr_log_probs / length_penalty
-    vocab_size = curr_scores.shape[-1].value or tf.shape(curr_scores)[-1]
 
-    # Select top-k candidates
-    # [batch_size, beam_size * vocab_size]
-    curr_scores = tf.reshape(curr_scores, [-1, beam_size * vocab_size])
+    # Select top-k candidates in two stages: a per-beam top-k over the
+    # vocabulary followed by a merge of the surviving candidates, which
+    # scans far fewer keys than a top-k over [batch, beam * vocab].
+    # Per-beam selection is invariant to the per-row logsumexp shift and
+    # to the accumulated beam score, both constant within a row, so the
+    # candidates are picked from the raw logits and only the survivors
+    # are normalized and accumulated
+    # [batch_size, beam_size, 2 * beam_size]
+    beam_logits, beam_symbols = tf.nn.top_k(step_logits, k=2 * beam_size)
+    beam_log_probs = (beam_logits - tf.expand_dims(step_lse, 2)
+                      + tf.expand_dims(log_probs, 2))
+    # [batch_size, beam_size * 2 * beam_size]
+    beam_log_probs = tf.reshape(beam_log_probs,
+                                [-1, beam_size * 2 * beam_size])
+    beam_symbols = tf.reshape(beam_symbols, [-1, beam_size * 2 * beam_size])
     # [batch_size, 2 * beam_size]
-    top_scores, top_indices = tf.nn.top_k(curr_scores, k=2 * beam_size)
+    top_log_probs, top_coordinates = tf.nn.top_k(beam_log_probs,
+                                                 k=2 * beam_size)
+    top_scores = top_log_probs / length_penalty
     # Shape: [batch_size, 2 * beam_size]
-    beam_indices = top_indices // vocab_size
-    symbol_indices = top_indices % vocab_size
+    beam_indices = top_coordinates // (2 * beam_size)
+    symbol_indices = utils.gather_2d(beam_symbols, top_coordinates)
     # Expand sequences
-    # [batch_size, 2 * beam_size, time]
+    # [batch_size, 2 * beam_size, length]
     candidate_seqs = utils.gather_2d(seqs, beam_indices)
-    candidate_seqs = tf.concat([candidate_seqs,
-                                tf.expand_dims(symbol_indices, 2)], 2)
+    candidate_seqs = _write_symbols(candidate_seqs, symbol_indices, time + 1)
 
     # Expand sequences
     # Suppress finished sequences
@@ -94,10 +149,15 @@ def _beam_search_step(time, func, state, batch_size, beam_size, alpha,
     alive_symbols = utils.gather_2d(symbol_indices, alive_indices)
     alive_indices = utils.gather_2d(beam_indices, alive_indices)
     alive_seqs = utils.gather_2d(seqs, alive_indices)
-    # [batch_size, beam_size, time + 1]
-    alive_seqs = tf.concat([alive_seqs, tf.expand_dims(alive_symbols, 2)], 2)
-    alive_state = nest.map_structure(
-        lambda x: utils.gather_2d(x, alive_indices),
+    # [batch_size, beam_size, length]
+    alive_seqs = _write_symbols(alive_seqs, alive_symbols, time + 1)
+    # Reorder the flat [batch * beam, ...] state with a single gather per
+    # tensor instead of a split-gather-merge round trip
+    batch_pos = tf.range(batch_size) * beam_size
+    flat_alive_indices = tf.reshape(
+        alive_indices + tf.expand_dims(batch_pos, 1), [-1])
+    alive_state = utils.map_structure(
+        lambda x: tf.gather(x, flat_alive_indices),
         next_state)
     alive_log_probs = alive_scores * length_penalty
 
@@ -111,9 +171,6 @@ def _beam_search_step(time, func, state, batch_size, beam_size, alpha,
     # [batch, beam_size]
     fin_scores, fin_indices = tf.nn.top_k(fin_scores, beam_size)
     fin_flags = utils.gather_2d(fin_flags, fin_indices)
-    pad_seqs = tf.fill([batch_size, beam_size, 1],
-                       tf.constant(pad_id, tf.int32))
-    prev_fin_seqs = tf.concat([prev_fin_seqs, pad_seqs], axis=2)
     fin_seqs = tf.concat([prev_fin_seqs, candidate_seqs], axis=1)
     fin_seqs = utils.gather_2d(fin_seqs, fin_indices)
 
@@ -127,12 +184,19 @@ def _beam_search_step(time, func, state, batch_size, beam_size, alpha,
 
 
 def beam_search(func, state, batch_size, beam_size, max_length, alpha,
-                pad_id, bos_id, eos_id):
+                pad_id, bos_id, eos_id, use_jit=False):
+    max_step = tf.reduce_max(max_length)
+
+    # Sequence buffers are pre-allocated at their final length and written
+    # in-place, which keeps their shapes constant across loop iterations
+    # and avoids re-allocating O(time) memory every step
     init_seqs = tf.fill([batch_size, beam_size, 1], bos_id)
+    init_seqs = tf.pad(init_seqs, [[0, 0], [0, 0], [0, max_step]],
+                       constant_values=pad_id)
     init_log_probs = tf.constant([[0.] + [tf.float32.min] * (beam_size - 1)])
     init_log_probs = tf.tile(init_log_probs, [batch_size, 1])
     init_scores = tf.zeros_like(init_log_probs)
-    fin_seqs = tf.zeros([batch_size, beam_size, 1], tf.int32)
+    fin_seqs = tf.fill([batch_size, beam_size, max_step + 1], pad_id)
     fin_scores = tf.fill([batch_size, beam_size], tf.float32.min)
     fin_flags = tf.zeros([batch_size, beam_size], tf.bool)
 
@@ -142,20 +206,27 @@ def beam_search(func, state, batch_size, beam_size, max_length, alpha,
         finish=(fin_flags, fin_seqs, fin_scores),
     )
 
-    max_step = tf.reduce_max(max_length)
-
     def _is_finished(t, s):
         log_probs = s.inputs[1]
         finished_flags = s.finish[0]
         finished_scores = s.finish[2]
-        max_lp = tf.pow(((5.0 + tf.to_float(max_step)) / 6.0), alpha)
-        best_alive_score = log_probs[:, 0] / max_lp
-        worst_finished_score = tf.reduce_min(
-            finished_scores * tf.to_float(finished_flags), axis=1)
-        add_mask = 1.0 - tf.to_float(tf.reduce_any(finished_flags, 1))
-        worst_finished_score += tf.float32.min * add_mask
-        bound_is_met = tf.reduce_all(tf.greater(worst_finished_score,
-                                                best_alive_score))
+
+        def _bound_is_met():
+            max_lp = tf.pow(((5.0 + tf.to_float(max_step)) / 6.0), alpha)
+            best_alive_score = log_probs[:, 0] / max_lp
+            worst_finished_score = tf.reduce_min(
+                finished_scores * tf.to_float(finished_flags), axis=1)
+            add_mask = 1.0 - tf.to_float(tf.reduce_any(finished_flags, 1))
+            worst_finished_score += tf.float32.min * add_mask
+            return tf.reduce_all(tf.greater(worst_finished_score,
+                                            best_alive_score))
+
+        # The bound check forces a device-to-host sync, so it only runs
+        # every few steps. Terminating late by at most that many steps
+        # does not change the search results
+        bound_is_met = tf.cond(
+            tf.equal(tf.mod(t, _CHECK_TERMINATION_STEPS), 0),
+            _bound_is_met, lambda: tf.constant(False))
 
         cond = tf.logical_and(tf.less(t, max_step),
                               tf.logical_not(bound_is_met))
@@ -163,8 +234,16 @@ def beam_search(func, state, batch_size, beam_size, max_length, alpha,
         return cond
 
     def _loop_fn(t, s):
+        # The step launches dozens of small kernels, so its execution time
+        # is dominated by per-op dispatch overhead. Compiling the step with
+        # XLA fuses these kernels into a few larger ones.
+        if use_jit:
+            with jit.experimental_jit_scope():
+                return _beam_search_step(t, func, s, batch_size, beam_size,
+                                         alpha, eos_id)
+
         outs = _beam_search_step(t, func, s, batch_size, beam_size, alpha,
-                                 pad_id, eos_id)
+                                 eos_id)
         return outs
 
     time = tf.constant(0, name="time")
@@ -172,7 +251,7 @@ def beam_search(func, state, batch_size, beam_size, max_length, alpha,
         inputs=(tf.TensorShape([None, None, None]),
                 tf.TensorShape([None, None]),
                 tf.TensorShape([None, None])),
-        state=nest.map_structure(utils.infer_shape_invariants, state.state),
+        state=utils.map_structure(utils.infer_shape_invariants, state.state),
         finish=(tf.TensorShape([None, None]),
                 tf.TensorShape([None, None, None]),
                 tf.TensorShape([None, None]))
@@ -234,14 +313,13 @@ def create_inference_graph(models, features, params):
     eos_id = params.mapping["target"][params.eos]
 
     # Expand the inputs
-    # [batch, length] => [batch, beam_size, length]
-    features["source"] = tf.expand_dims(features["source"], 1)
-    features["source"] = tf.tile(features["source"], [1, beam_size, 1])
-    shape = tf.shape(features["source"])
-
-    # [batch, beam_size, length] => [batch * beam_size, length]
-    features["source"] = tf.reshape(features["source"],
-                                    [shape[0] * shape[1], shape[2]])
+    # [batch, length] => [batch * beam_size, length]
+    # The tiled source is only consumed by non-incremental models; for a
+    # purely incremental ensemble the tile ops are pruned from the graph
+    tiled_source = tf.expand_dims(features["source"], 1)
+    tiled_source = tf.tile(tiled_source, [1, beam_size, 1])
+    shape = tf.shape(tiled_source)
+    tiled_source = tf.reshape(tiled_source, [shape[0] * shape[1], shape[2]])
 
     # For source sequence length
     features["source_length"] = tf.expand_dims(features["source_length"], 1)
@@ -254,12 +332,21 @@ def create_inference_graph(models, features, params):
     # [batch, beam_size, length] => [batch * beam_size, length]
     features["source_length"] = tf.reshape(features["source_length"],
                                            [shape[0] * shape[1]])
-    decoding_fn = _get_inference_fn(funcs, features)
-    states = nest.map_structure(
-        lambda x: utils.tile_to_beam_size(x, beam_size),
+    fp16_cache = getattr(params, "fp16_cache", False)
+    decoding_fn = _get_inference_fn(funcs, features, tiled_source,
+                                    fp16_cache=fp16_cache)
+    # The decoder state stays flat at [batch * beam, ...] for the whole
+    # search, so it is tiled and merged exactly once here
+    states = utils.map_structure(
+        lambda x: utils.merge_first_two_dims(
+            utils.tile_to_beam_size(x, beam_size)),
         states)
 
+    if fp16_cache:
+        states = _cast_state(states, tf.float16)
+
     seqs, scores = beam_search(decoding_fn, states, batch_size, beam_size,
-                               max_length, alpha, pad_id, bos_id, eos_id)
+                               max_length, alpha, pad_id, bos_id, eos_id,
+                               use_jit=getattr(params, "decode_jit", False))
 
     return seqs[:, :top_beams, 1:], scores[:, :top_beams]
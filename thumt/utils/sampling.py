@@ -10,7 +10,6 @@ import tensorflow as tf
 import thumt.utils.common as utils
 
 from collections import namedtuple
-from tensorflow.python.util import nest
 
 
 class SamplerState(namedtuple("SamplerState",
@@ -42,8 +41,9 @@ def _get_inference_fn(model_fns, features):
                 outputs.append(output)
                 next_state.append({})
 
-        # Ensemble
-        log_prob = tf.add_n(outputs) / float(len(outputs))
+        # Ensemble: models return unnormalized logits
+        logits = tf.add_n(outputs) / float(len(outputs))
+        log_prob = tf.nn.log_softmax(logits)
 
         return log_prob, next_state
 
@@ -62,9 +62,10 @@ def _sampling_step(time, func, state, min_length, max_length, pad_id, eos_id):
     add_mask = tf.one_hot(eos_id, vocab_size, dtype=step_log_probs.dtype,
                           on_value=step_log_probs.dtype.min,
                           off_value=0.0)
-    add_mask = utils.tile_batch(tf.reshape(add_mask, [1, -1]), batch_size)
-    add_mask = tf.where(time < min_length, add_mask, tf.zeros_like(add_mask))
-    step_log_probs = step_log_probs + add_mask
+    # Rows that reached their minimum length broadcast against a zeroed
+    # mask, which avoids tiling the mask to [batch, vocab_size]
+    unfinished = tf.expand_dims(tf.to_float(time < min_length), 1)
+    step_log_probs = step_log_probs + unfinished * add_mask
 
     # sample from distribution
     symbol_indices = tf.multinomial(step_log_probs, 1, output_dtype=tf.int32)
@@ -82,9 +83,8 @@ def _sampling_step(time, func, state, min_length, max_length, pad_id, eos_id):
     # Force sampler to generate <eos> if length exceed max_length
     eos_flags = tf.where(time > max_length, tf.ones([batch_size], tf.bool),
                          tf.zeros([batch_size], tf.bool))
-    eos_scores = tf.squeeze(utils.gather_2d(step_log_probs,
-                                            tf.fill([batch_size, 1], eos_id)),
-                            axis=1)
+    # <eos> is a fixed column, so a slice replaces the batched gather
+    eos_scores = step_log_probs[:, eos_id]
     eos_indices = tf.fill([batch_size, 1], eos_id)
     cond = tf.logical_and(tf.logical_not(curr_flags), eos_flags)
     curr_flags = tf.logical_or(curr_flags, eos_flags)
@@ -131,7 +131,7 @@ def random_sample(func, state, batch_size, min_length, max_length, pad_id,
     time = tf.constant(0, name="time")
     shape_invariants = SamplerState(
         inputs=tf.TensorShape([None, None]),
-        state=nest.map_structure(utils.infer_shape_invariants, state.state),
+        state=utils.map_structure(utils.infer_shape_invariants, state.state),
         scores=tf.TensorShape([None]),
         flags=tf.TensorShape([None])
     )
@@ -201,7 +201,7 @@ def create_sampling_graph(models, features, params):
     max_length = tf.to_int32(max_length)
 
     decoding_fn = _get_inference_fn(funcs, features)
-    states = nest.map_structure(lambda x: utils.tile_batch(x, num_samples),
+    states = utils.map_structure(lambda x: utils.tile_batch(x, num_samples),
                                 states)
 
     seqs, scores = random_sample(decoding_fn, states, batch_size * num_samples,